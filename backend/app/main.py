@@ -1,13 +1,29 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from typing import List
+from typing import Iterator, List, Optional
 from pathlib import Path
-import io, uuid, pickle, datetime
+import io, os, re, uuid, datetime, math, asyncio, threading
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+import torch
 import pdfplumber  # updated from PyPDF2
+from rank_bm25 import BM25Okapi
+
+# pypdfium2 extracts text far faster; pdfplumber remains the fallback
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+    print("Warning: pypdfium2 not installed. Falling back to pdfplumber for PDFs.")
+
+# PDFium is not thread-safe, even across documents; uploads run extraction
+# on executor threads, so every pdfium call goes through this lock
+PDFIUM_LOCK = threading.Lock()
+from .services.model_singleton import get_model
+from .services.embedding import embed_chunks, embed_query
+from .services.chunk_store import ChunkStore
+from .services.pickle_frames import load_frames, append_frame, write_frames
 
 # ----------------------------
 # Paths and Constants
@@ -18,35 +34,189 @@ FAISS_INDEX_FILE = DATA_DIR / "faiss.index"
 CHUNKS_FILE = DATA_DIR / "chunks.pkl"
 METADATA_FILE = DATA_DIR / "metadata.pkl"
 TOP_K = 5
+SEMANTIC_K = 50       # FAISS candidates reranked with BM25
+SEMANTIC_WEIGHT = 0.5
 EMBEDDING_DIM = 384  # for all-MiniLM-L6-v2
+PQ_M = 48            # PQ sub-quantizers (384 / 48 = 8 dims each)
+PQ_NBITS = 8
+IVF_NPROBE = 8
+QUANTIZE_MIN_VECTORS = 10_000  # below this, exact float32 vectors are cheap enough
+INDEX_TIERS = ("flat", "sq8", "ivfpq")
+
+# ----------------------------
+# Index construction
+# ----------------------------
+def ivf_nlist(n: int) -> int:
+    return max(32, int(4 * math.sqrt(n)))
+
+def ivf_trainable(n: int) -> bool:
+    # k-means wants ~39 training points per coarse centroid
+    return n >= 39 * ivf_nlist(n)
+
+def index_tier(n: int) -> str:
+    if ivf_trainable(n):
+        return "ivfpq"
+    if n >= QUANTIZE_MIN_VECTORS:
+        return "sq8"
+    return "flat"
+
+def current_tier(idx: faiss.Index) -> str:
+    if isinstance(idx, faiss.IndexIVF):
+        return "ivfpq"
+    if isinstance(faiss.downcast_index(idx.index), faiss.IndexScalarQuantizer):
+        return "sq8"
+    return "flat"
+
+def new_faiss_id() -> int:
+    return uuid.uuid4().int & ((1 << 63) - 1)
+
+def build_index(embeddings: np.ndarray, ids: np.ndarray) -> faiss.Index:
+    """
+    Exact IndexFlatIP for small corpora, an 8-bit scalar quantizer (4x less
+    RAM) from QUANTIZE_MIN_VECTORS on, and IVFPQ (48 bytes/vector) once there
+    is enough data to train the coarse quantizer. Quantizers are trained on
+    `embeddings`. All score by inner product, so vectors must be L2-normalized
+    (cosine similarity), and all are keyed by the `faissId` stored in metadata
+    so deletes can use remove_ids.
+    """
+    n = len(embeddings)
+    tier = index_tier(n)
+    if tier == "ivfpq":
+        quantizer = faiss.IndexFlatIP(EMBEDDING_DIM)
+        new_index = faiss.IndexIVFPQ(
+            quantizer, EMBEDDING_DIM, ivf_nlist(n), PQ_M, PQ_NBITS, faiss.METRIC_INNER_PRODUCT
+        )
+        new_index.train(embeddings)
+        new_index.nprobe = IVF_NPROBE
+    elif tier == "sq8":
+        sq = faiss.IndexScalarQuantizer(
+            EMBEDDING_DIM, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
+        sq.train(embeddings)
+        new_index = faiss.IndexIDMap2(sq)
+    else:
+        new_index = faiss.IndexIDMap2(faiss.IndexFlatIP(EMBEDDING_DIM))
+    if n:
+        new_index.add_with_ids(embeddings, ids)
+    return new_index
+
+def empty_index() -> faiss.Index:
+    return build_index(np.empty((0, EMBEDDING_DIM), dtype="float32"), np.empty(0, dtype="int64"))
 
 # ----------------------------
 # Initialize or Load FAISS
 # ----------------------------
+def write_index():
+    # Write beside and rename so readers that mmap the old file keep a valid copy
+    tmp_file = FAISS_INDEX_FILE.with_suffix(".index.tmp")
+    faiss.write_index(index, str(tmp_file))
+    os.replace(tmp_file, FAISS_INDEX_FILE)
+
+def ensure_writable():
+    """
+    Swap an mmapped (read-only) IVF index for an in-memory copy before mutating it.
+    """
+    global index, index_mmapped
+    if index_mmapped:
+        index = faiss.read_index(str(FAISS_INDEX_FILE))
+        index.nprobe = IVF_NPROBE
+        index_mmapped = False
+
 if FAISS_INDEX_FILE.exists():
-    index = faiss.read_index(str(FAISS_INDEX_FILE))
+    # IO_FLAG_MMAP only affects IVF indexes: their inverted lists are paged in
+    # on demand instead of read into RAM. Flat indexes load as usual.
+    index = faiss.read_index(str(FAISS_INDEX_FILE), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    index_mmapped = isinstance(index, faiss.IndexIVF)
+    if index_mmapped:
+        index.nprobe = IVF_NPROBE
 else:
-    index = faiss.IndexFlatL2(EMBEDDING_DIM)
+    index = empty_index()
+    index_mmapped = False
 
 # ----------------------------
 # Load chunks and metadata
 # ----------------------------
-if CHUNKS_FILE.exists():
-    with open(CHUNKS_FILE, "rb") as f:
-        chunks = pickle.load(f)
-else:
-    chunks = []
+chunks = ChunkStore(load_frames(CHUNKS_FILE))
+metadata = load_frames(METADATA_FILE)
 
-if METADATA_FILE.exists():
-    with open(METADATA_FILE, "rb") as f:
-        metadata = pickle.load(f)
-else:
-    metadata = []
+def clean_chunk(chunk: str) -> str:
+    return chunk.replace('\x0c', ' ').strip()
+
+# Lower-cased copies for keyword matching, kept parallel to chunks
+chunks_lower = ChunkStore(clean_chunk(c).lower() for c in chunks)
+
+SENTENCE_END_RE = re.compile(r"[.!?]\s+")
+
+def sentence_ends(text: str) -> np.ndarray:
+    """
+    Offsets just past each sentence terminator (and its trailing whitespace).
+    """
+    return np.fromiter((m.end() for m in SENTENCE_END_RE.finditer(text)), dtype=np.int32)
+
+# Sentence boundaries of each cleaned chunk, kept parallel to chunks
+chunk_sentence_ends = [sentence_ends(clean_chunk(c)) for c in chunks]
+
+TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+def build_bm25(texts: List[str]) -> Optional[BM25Okapi]:
+    corpus = [TOKEN_RE.findall(t) for t in texts]
+    if not any(corpus):
+        # BM25Okapi divides by the vocabulary size; rank semantically instead
+        return None
+    return BM25Okapi(corpus)
+
+# Lexical index over chunks_lower; rebuilt off the event loop after uploads/deletes
+bm25 = build_bm25(list(chunks_lower))
+bm25_generation = 0
+
+async def refresh_bm25(positions_shifted: bool):
+    """
+    Rebuild the BM25 index in a worker thread. Until it lands, an index from
+    before an upload keeps scoring the older chunks (new ones score 0), but one
+    from before a delete is dropped since chunk positions have moved.
+    """
+    global bm25, bm25_generation
+    bm25_generation += 1
+    generation = bm25_generation
+    if positions_shifted:
+        bm25 = None
+    new_bm25 = await asyncio.to_thread(build_bm25, list(chunks_lower))
+    if generation == bm25_generation:  # a newer rebuild supersedes this one
+        bm25 = new_bm25
+
+def min_max(scores: np.ndarray) -> np.ndarray:
+    spread = scores.max() - scores.min()
+    return (scores - scores.min()) / spread if spread > 0 else np.zeros_like(scores)
 
 # ----------------------------
 # Load embedding model
 # ----------------------------
-model = SentenceTransformer("all-MiniLM-L6-v2")
+# Inference only: use every core and skip autograd bookkeeping
+torch.set_num_threads(os.cpu_count() or 1)
+torch.set_grad_enabled(False)
+
+model = get_model()
+
+# Indexes saved before cosine similarity / stable ids are rebuilt once
+if index.metric_type != faiss.METRIC_INNER_PRODUCT or any("faissId" not in m for m in metadata):
+    for m in metadata:
+        m.setdefault("faissId", new_faiss_id())
+    if chunks:
+        index = build_index(
+            embed_chunks(list(chunks), model),
+            np.array([m["faissId"] for m in metadata], dtype="int64"),
+        )
+    else:
+        index = empty_index()
+    index_mmapped = False
+    write_index()
+    write_frames(METADATA_FILE, metadata)
+
+# FAISS returns faissIds; map them back to positions in chunks/metadata
+id_to_pos = {m["faissId"]: i for i, m in enumerate(metadata)}
 
 # ----------------------------
 # FastAPI app
@@ -64,15 +234,90 @@ app.add_middleware(
 # Helper functions
 # ----------------------------
 def save_data():
-    with open(CHUNKS_FILE, "wb") as f:
-        pickle.dump(chunks, f)
-    with open(METADATA_FILE, "wb") as f:
-        pickle.dump(metadata, f)
-    faiss.write_index(index, str(FAISS_INDEX_FILE))
+    """
+    Rewrite chunks and metadata in full (needed after deletes).
+    """
+    write_frames(CHUNKS_FILE, list(chunks))
+    write_frames(METADATA_FILE, metadata)
+    write_index()
+
+def append_data(new_chunks: List[str], new_metadata: List[dict]):
+    """
+    Append only the rows from one upload as a new pickle frame.
+    """
+    append_frame(CHUNKS_FILE, new_chunks)
+    append_frame(METADATA_FILE, new_metadata)
+    write_index()
+
+def add_embeddings(embeddings: np.ndarray, ids: np.ndarray):
+    """
+    Add vectors to the index, retraining into the next quantized tier once the
+    corpus outgrows the current one.
+    """
+    global index
+    ensure_writable()
+    target = index_tier(index.ntotal + len(embeddings))
+    if INDEX_TIERS.index(target) > INDEX_TIERS.index(current_tier(index)):
+        existing = index.index.reconstruct_n(0, index.ntotal)
+        existing_ids = faiss.vector_to_array(index.id_map)
+        index = build_index(np.vstack([existing, embeddings]), np.concatenate([existing_ids, ids]))
+    else:
+        index.add_with_ids(embeddings, ids)
+
+def clean_page_text(page_text: str) -> str:
+    page_text = page_text.encode('utf-8', errors='ignore').decode('utf-8', errors='ignore')
+    return page_text.replace('\r\n', '\n').replace('\x0c', ' ').strip()
+
+def extract_pdf_text_pdfium(file_bytes: bytes) -> str:
+    pages = []
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(file_bytes)
+        try:
+            for page in pdf:
+                # Close explicitly so no PDFium finalizer runs outside the lock
+                textpage = page.get_textpage()
+                page_text = textpage.get_text_range()
+                textpage.close()
+                page.close()
+                if page_text:
+                    pages.append(clean_page_text(page_text) + "\n")
+        finally:
+            pdf.close()
+    return "".join(pages)
 
-def chunk_text(text: str, chunk_size: int = 500) -> List[str]:
-    words = text.split()
-    return [" ".join(words[i:i+chunk_size]) for i in range(0, len(words), chunk_size)]
+def extract_pdf_text_pdfplumber(file_bytes: bytes) -> str:
+    pages = []
+    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+        for page in pdf.pages:
+            page_text = page.extract_text()
+            if page_text:
+                pages.append(clean_page_text(page_text) + "\n")
+    return "".join(pages)
+
+def extract_pdf_text(file_bytes: bytes) -> str:
+    if pdfium is not None:
+        try:
+            text = extract_pdf_text_pdfium(file_bytes)
+            if text.strip():
+                return text
+        except pdfium.PdfiumError as e:
+            print(f"pypdfium2 failed ({e}), falling back to pdfplumber")
+    return extract_pdf_text_pdfplumber(file_bytes)
+
+WORD_RE = re.compile(r"\S+")
+
+def chunk_text(text: str, chunk_size: int = 500) -> Iterator[str]:
+    """
+    Yield `chunk_size`-word windows in one pass, without splitting the whole text first.
+    """
+    words = []
+    for match in WORD_RE.finditer(text):
+        words.append(match.group())
+        if len(words) == chunk_size:
+            yield " ".join(words)
+            words = []
+    if words:
+        yield " ".join(words)
 
 # ----------------------------
 # Endpoints
@@ -88,34 +333,30 @@ async def upload_files(files: List[UploadFile] = File(...)):
     # Only process the first file to show "1 file uploaded"
     file = files[0]
 
-    # Handle PDF files using pdfplumber
+    # Handle PDF files using pypdfium2 (pdfplumber fallback)
     if file.filename.lower().endswith(".pdf"):
         file_bytes = await file.read()
-        content_text = ""
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    # Clean up text
-                    page_text = page_text.encode('utf-8', errors='ignore').decode('utf-8', errors='ignore')
-                    page_text = page_text.replace('\x0c', ' ').strip()
-                    content_text += page_text + "\n"
+        # Extraction is CPU-bound; keep it off the event loop
+        content_text = await asyncio.to_thread(extract_pdf_text, file_bytes)
     else:
         content_bytes = await file.read()
         content_text = content_bytes.decode("utf-8", errors="ignore")
 
     print(content_text)
-    file_chunks = chunk_text(content_text)
+    file_chunks = list(chunk_text(content_text))
 
     if file_chunks:
-        embeddings = model.encode(file_chunks, show_progress_bar=False)
-        embeddings = np.array(embeddings).astype("float32")
-        index.add(embeddings)
+        faiss_ids = [new_faiss_id() for _ in file_chunks]
+        add_embeddings(embed_chunks(file_chunks, model), np.array(faiss_ids, dtype="int64"))
 
         chunks.extend(file_chunks)
-        for i, chunk in enumerate(file_chunks):
+        chunks_lower.extend(clean_chunk(c).lower() for c in file_chunks)
+        chunk_sentence_ends.extend(sentence_ends(clean_chunk(c)) for c in file_chunks)
+        for chunk, faiss_id in zip(file_chunks, faiss_ids):
+            id_to_pos[faiss_id] = len(metadata)
             metadata_entry = {
                 "id": str(uuid.uuid4()),
+                "faissId": faiss_id,
                 "source": file.filename,
                 "uploadedAt": datetime.datetime.utcnow().isoformat(),
                 "wordCount": len(chunk.split())
@@ -128,30 +369,29 @@ async def upload_files(files: List[UploadFile] = File(...)):
                 "metadata": metadata_entry
             })
 
-    save_data()
+        append_data(file_chunks, metadata[-len(file_chunks):])
+        await refresh_bm25(positions_shifted=False)
+
     return JSONResponse(content=uploaded_docs)
 
 @app.delete("/delete/{doc_id}")
 async def delete_document(doc_id: str):
-    global chunks, metadata, index
+    global id_to_pos
     indices_to_delete = [i for i, m in enumerate(metadata) if m["id"] == doc_id]
     if not indices_to_delete:
         raise HTTPException(status_code=404, detail="Document not found")
 
+    ensure_writable()
+    index.remove_ids(np.array([metadata[i]["faissId"] for i in indices_to_delete], dtype="int64"))
+    chunks.delete(indices_to_delete)
+    chunks_lower.delete(indices_to_delete)
     for idx in sorted(indices_to_delete, reverse=True):
-        chunks.pop(idx)
+        chunk_sentence_ends.pop(idx)
         metadata.pop(idx)
-
-    # Rebuild FAISS
-    if chunks:
-        all_embeddings = model.encode(chunks, show_progress_bar=False)
-        all_embeddings = np.array(all_embeddings).astype("float32")
-        index = faiss.IndexFlatL2(EMBEDDING_DIM)
-        index.add(all_embeddings)
-    else:
-        index = faiss.IndexFlatL2(EMBEDDING_DIM)
+    id_to_pos = {m["faissId"]: i for i, m in enumerate(metadata)}
 
     save_data()
+    await refresh_bm25(positions_shifted=True)
     return {"status": "deleted", "id": doc_id}
 
 @app.post("/query")
@@ -161,34 +401,61 @@ async def query_documents(request: dict):
         return {"results": [], "synthesis": ""}
 
     query = query.lower().strip()
-    query_vec = model.encode([query]).astype("float32")
-    distances, indices = index.search(query_vec, TOP_K)
+    query_vec = embed_query(query)
+    distances, indices = index.search(query_vec, SEMANTIC_K)
+    pattern = re.compile(re.escape(query), re.IGNORECASE)
 
-    # Deduplicate and filter results
+    # Hybrid rerank: blend semantic and BM25 scores over the FAISS candidates
+    hits = [(id_to_pos[int(fid)], d) for fid, d in zip(indices[0], distances[0]) if fid >= 0]
+    if not hits:
+        return {"results": [], "synthesis": "", "top_k": TOP_K}
+    positions = np.array([pos for pos, _ in hits])
+    semantic = np.array([d for _, d in hits], dtype="float32")
+    if bm25 is None:  # no word tokens in the corpus, or rebuilding after a delete
+        combined = min_max(semantic)
+    else:
+        # Score only the candidates; get_scores would scan the whole corpus.
+        # Chunks added since the last rebuild are not in bm25 yet.
+        lexical = np.zeros(len(positions))
+        known = positions < bm25.corpus_size
+        lexical[known] = bm25.get_batch_scores(tokenize(query), positions[known].tolist())
+        combined = SEMANTIC_WEIGHT * min_max(semantic) + (1 - SEMANTIC_WEIGHT) * min_max(lexical)
+
+    # Deduplicate and keep the best TOP_K
     seen_chunks = set()
     results = []
-    for i, idx in enumerate(indices[0]):
-        chunk_text_clean = chunks[idx].replace('\x0c', ' ').strip()
+    result_positions = []
+    for i in np.argsort(-combined, kind="stable"):
+        idx = int(positions[i])
+        chunk_text_clean = clean_chunk(chunks[idx])
         if chunk_text_clean in seen_chunks:
             continue
         seen_chunks.add(chunk_text_clean)
-        # Include chunks containing the query term or related content
-        if query in chunk_text_clean.lower():
-            results.append({
-                "score": float(distances[0][i]),
-                "chunk": chunk_text_clean,
-                "source": metadata[idx].get("source", "unknown")
-            })
+        result_positions.append(idx)
+        results.append({
+            "score": float(combined[i]),
+            "chunk": chunk_text_clean,
+            "source": metadata[idx].get("source", "unknown")
+        })
+        if len(results) == TOP_K:
+            break
 
     # Generate synthesis: Extract sentences containing the query
     synthesis = ""
     if results:
         relevant_sentences = []
-        for result in results:
-            sentences = result["chunk"].split('. ')
-            for sentence in sentences:
-                if query in sentence.lower() and sentence.strip() not in relevant_sentences:
-                    relevant_sentences.append(sentence.strip())
+        for result, idx in zip(results, result_positions):
+            text, ends = result["chunk"], chunk_sentence_ends[idx]
+            for match in pattern.finditer(text):
+                # Locate the sentence enclosing the match from precomputed boundaries
+                k = np.searchsorted(ends, match.start(), side="right")
+                start = ends[k - 1] if k > 0 else 0
+                end = ends[k] if k < len(ends) else len(text)
+                sentence = text[start:end].strip()
+                if sentence and sentence not in relevant_sentences:
+                    relevant_sentences.append(sentence)
+            if len(relevant_sentences) >= 3:
+                break
         if relevant_sentences:
             synthesis = f"Summary for '{query}':\n- " + "\n- ".join(relevant_sentences[:3])  # Limit to 3 sentences
 
@@ -200,7 +467,7 @@ async def get_documents():
         {
             "id": m["id"],
             "title": m["source"],
-            "content": c.replace('\x0c', ' ').strip(),
+            "content": clean_chunk(c),
             "metadata": m
         }
         for c, m in zip(chunks, metadata)
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, UploadFile, File
 from fastapi.responses import JSONResponse
 from services.ingestion import load_documents_from_file  # function to load + chunk
-from services.embedding import generate_embedding        # function to embed
+from services.embedding import embed_chunks, load_model  # batched embedding
 from services.faiss_retriever import add_documents_to_index  # store in FAISS
 
 router = APIRouter()
@@ -14,7 +14,7 @@ async def upload_documents(files: list[UploadFile] = File(...)):
         content = await file.read()
         text = content.decode("utf-8")  # assuming text files
         chunks = load_documents_from_file(text, file.filename)  # chunking logic
-        embeddings = [generate_embedding(chunk) for chunk in chunks]
+        embeddings = embed_chunks(chunks, load_model())
         add_documents_to_index(chunks, embeddings, file.filename)
         
         added_docs.append({
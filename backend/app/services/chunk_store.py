@@ -0,0 +1,47 @@
+from typing import Iterable, Iterator
+import numpy as np
+
+class ChunkStore:
+    """
+    Chunk texts packed into one UTF-8 buffer plus an offsets array, instead of
+    a list of individual str objects. Chunk i is blob[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, chunks: Iterable[str] = ()):
+        self.blob = bytearray()
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.extend(chunks)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("chunk index out of range")
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def extend(self, chunks: Iterable[str]):
+        encoded = [chunk.encode("utf-8") for chunk in chunks]
+        if not encoded:
+            return
+        lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=len(encoded))
+        self.offsets = np.concatenate([self.offsets, self.offsets[-1] + np.cumsum(lengths)])
+        self.blob.extend(b"".join(encoded))
+
+    def delete(self, positions: Iterable[int]):
+        """
+        Drop the chunks at `positions`, compacting the buffer with one masked copy.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        keep[list(positions)] = False
+        lengths = np.diff(self.offsets)
+        byte_mask = np.repeat(keep, lengths)
+        self.blob = bytearray(np.frombuffer(self.blob, dtype=np.uint8)[byte_mask].tobytes())
+        self.offsets = np.concatenate([[0], np.cumsum(lengths[keep])]).astype(np.int64)
@@ -1,35 +1,124 @@
 from typing import List
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from sentence_transformers import SentenceTransformer
+from sentence_transformers.util import batch_to_device
 import numpy as np
+import torch
 import pickle
+import sqlite3
+import hashlib
+from contextlib import closing
 from pathlib import Path
 
-# Choose your model
-MODEL_NAME = "all-MiniLM-L6-v2"
+try:
+    from .model_singleton import MODEL_NAME, get_model, model_tag
+except ImportError:  # run as a script
+    from model_singleton import MODEL_NAME, get_model, model_tag
+
+# Inputs are length-sorted before batching, so large batches pad little
+EMBED_BATCH_SIZE = 1024
 
 # Paths to save embeddings and chunks
 SAVE_DIR = Path(__file__).resolve().parents[2] / "data"
 EMBEDDINGS_FILE = SAVE_DIR / "embeddings.npy"
 CHUNKS_FILE = SAVE_DIR / "chunks.pkl"
+EMB_CACHE_FILE = SAVE_DIR / "emb_cache.db"
+SQLITE_MAX_VARS = 500  # keep IN (...) lists under SQLite's parameter limit
+QUERY_CACHE_SIZE = 4096
 
 def load_model(model_name: str = MODEL_NAME) -> SentenceTransformer:
     """
-    Load and return a sentence-transformers model.
+    Return the shared sentence-transformers model.
+    """
+    return get_model(model_name)
+
+def _chunk_key(chunk: str, tag: str) -> bytes:
+    return hashlib.sha256(f"{tag}\0{chunk}".encode("utf-8")).digest()
+
+def _open_cache() -> sqlite3.Connection:
+    SAVE_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(EMB_CACHE_FILE)
+    conn.execute("CREATE TABLE IF NOT EXISTS embeddings (sha256 BLOB PRIMARY KEY, vec BLOB)")
+    return conn
+
+def _encode(chunks: List[str], model: SentenceTransformer) -> np.ndarray:
+    """
+    Encode length-sorted batches (as model.encode does), tokenizing the next
+    batch on a background thread while the current one runs through the model.
     """
-    print(f"Loading embedding model: {model_name}")
-    model = SentenceTransformer(model_name)
-    return model
+    order = np.argsort([-len(chunk) for chunk in chunks], kind="stable")
+    batches = [
+        [chunks[i] for i in order[start:start + EMBED_BATCH_SIZE]]
+        for start in range(0, len(chunks), EMBED_BATCH_SIZE)
+    ]
+
+    outputs = []
+    with ThreadPoolExecutor(max_workers=1) as tokenizer_pool, torch.inference_mode():
+        pending = tokenizer_pool.submit(model.tokenize, batches[0])
+        for i in range(len(batches)):
+            features = pending.result()
+            if i + 1 < len(batches):
+                pending = tokenizer_pool.submit(model.tokenize, batches[i + 1])
+            features = batch_to_device(features, model.device)
+            batch_embeddings = model.forward(features)["sentence_embedding"]
+            batch_embeddings = torch.nn.functional.normalize(batch_embeddings, p=2, dim=1)
+            outputs.append(batch_embeddings.float().cpu().numpy())
+
+    embeddings = np.empty((len(chunks), outputs[0].shape[1]), dtype="float32")
+    embeddings[order] = np.vstack(outputs)
+    return embeddings
 
 def embed_chunks(chunks: List[str], model: SentenceTransformer) -> np.ndarray:
     """
-    Generate embeddings for a list of text chunks.
+    Generate L2-normalized embeddings for a list of text chunks in batches.
+    Vectors are cached on disk by content hash, so only unseen chunks are encoded.
     """
-    print(f"Generating embeddings for {len(chunks)} chunks...")
-    embeddings = model.encode(chunks, show_progress_bar=True)
-    embeddings_array = np.array(embeddings)
+    if not chunks:
+        return np.empty((0, model.get_sentence_embedding_dimension()), dtype="float32")
+
+    tag = model_tag(model)
+    keys = [_chunk_key(chunk, tag) for chunk in chunks]
+    vectors = {}
+    with closing(_open_cache()) as conn:
+        unique_keys = list(dict.fromkeys(keys))
+        for i in range(0, len(unique_keys), SQLITE_MAX_VARS):
+            batch = unique_keys[i:i + SQLITE_MAX_VARS]
+            rows = conn.execute(
+                f"SELECT sha256, vec FROM embeddings WHERE sha256 IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+            vectors.update((key, np.frombuffer(vec, dtype="float32")) for key, vec in rows)
+
+        misses = {key: chunk for key, chunk in zip(keys, chunks) if key not in vectors}
+        print(f"Generating embeddings for {len(misses)} of {len(chunks)} chunks ({len(chunks) - len(misses)} cached)...")
+        if misses:
+            new_vectors = _encode(list(misses.values()), model)
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (sha256, vec) VALUES (?, ?)",
+                    [(key, vec.tobytes()) for key, vec in zip(misses, new_vectors)],
+                )
+            vectors.update(zip(misses, new_vectors))
+
+    embeddings_array = np.stack([vectors[key] for key in keys])
     print(f"Embeddings generated: {embeddings_array.shape}")
     return embeddings_array
 
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _embed_query_bytes(query: str) -> bytes:
+    with torch.inference_mode():
+        vec = get_model().encode([query], convert_to_numpy=True, normalize_embeddings=True)
+    return np.asarray(vec, dtype="float32").tobytes()
+
+def embed_query(query: str) -> np.ndarray:
+    """
+    Return the normalized (1, dim) float32 embedding of a query, memoized.
+    MiniLM's tokenizer is uncased, so case and whitespace are folded into the key.
+    """
+    key = " ".join(query.lower().split())
+    return np.frombuffer(_embed_query_bytes(key), dtype="float32").reshape(1, -1)
+
 def save_embeddings(embeddings: np.ndarray, chunks: List[str]):
     """
     Save embeddings and chunks locally.
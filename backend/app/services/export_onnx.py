@@ -0,0 +1,24 @@
+"""
+One-time export of the embedding model to ONNX with int8 dynamic quantization.
+
+    python backend/app/services/export_onnx.py
+
+Requires `optimum[onnxruntime]`. Once the export exists, get_model() loads it
+instead of the PyTorch weights; pooling and normalization are unchanged.
+"""
+from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+try:
+    from .model_singleton import MODEL_NAME, ONNX_DIR, ONNX_FILE_NAME
+except ImportError:  # run as a script
+    from model_singleton import MODEL_NAME, ONNX_DIR, ONNX_FILE_NAME
+
+def export(model_name: str = MODEL_NAME):
+    ONNX_DIR.mkdir(parents=True, exist_ok=True)
+    model = SentenceTransformer(model_name, backend="onnx")
+    model.save_pretrained(str(ONNX_DIR))
+    export_dynamic_quantized_onnx_model(model, "avx512_vnni", str(ONNX_DIR))
+    print(f"Saved quantized ONNX model to {ONNX_DIR / ONNX_FILE_NAME}")
+
+if __name__ == "__main__":
+    export()
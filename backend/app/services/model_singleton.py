@@ -0,0 +1,43 @@
+from functools import lru_cache
+from pathlib import Path
+import torch
+from sentence_transformers import SentenceTransformer
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+# int8 ONNX export produced by export_onnx.py
+ONNX_DIR = Path(__file__).resolve().parents[2] / "data" / "minilm-onnx"
+ONNX_FILE_NAME = "onnx/model_qint8_avx512_vnni.onnx"
+
+@lru_cache(maxsize=None)
+def get_model(model_name: str = MODEL_NAME) -> SentenceTransformer:
+    """
+    Load a sentence-transformers model once per process and reuse it.
+    Uses the quantized ONNX Runtime export when one is available, and
+    half precision on CUDA (callers cast results back to float32 for FAISS).
+    """
+    if model_name == MODEL_NAME and (ONNX_DIR / ONNX_FILE_NAME).exists():
+        print(f"Loading ONNX embedding model: {ONNX_DIR / ONNX_FILE_NAME}")
+        model = SentenceTransformer(
+            str(ONNX_DIR), backend="onnx", model_kwargs={"file_name": ONNX_FILE_NAME}
+        )
+        model.embedding_tag = f"{model_name}:onnx:{ONNX_FILE_NAME}"
+        return model
+    print(f"Loading embedding model: {model_name}")
+    model = SentenceTransformer(model_name)
+    if torch.cuda.is_available():
+        model = model.to("cuda").half()
+        model.embedding_tag = f"{model_name}:torch:fp16"
+    else:
+        model.embedding_tag = f"{model_name}:torch:fp32"
+    return model
+
+def model_tag(model: SentenceTransformer) -> str:
+    """
+    Identify the weights, backend and precision behind a model's vectors.
+    """
+    tag = getattr(model, "embedding_tag", None)
+    if tag is None:
+        # Loaded outside get_model(); fall back to what the model reports
+        tag = f"{model.tokenizer.name_or_path}:{getattr(model, 'backend', 'torch')}"
+    return tag
@@ -0,0 +1,33 @@
+from pathlib import Path
+import pickle
+
+# On-disk format for chunks.pkl / metadata.pkl: a sequence of pickled lists,
+# one frame per upload. A file written by a single pickle.dump is one frame.
+
+def load_frames(path: Path) -> list:
+    """
+    Read every frame in `path` and concatenate them into one list.
+    """
+    items = []
+    if path.exists():
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    items.extend(pickle.load(f))
+                except EOFError:
+                    break
+    return items
+
+def append_frame(path: Path, items: list):
+    """
+    Append `items` as a new frame without rewriting what is already there.
+    """
+    with open(path, "ab") as f:
+        pickle.dump(items, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def write_frames(path: Path, items: list):
+    """
+    Replace the file with a single frame holding `items`.
+    """
+    with open(path, "wb") as f:
+        pickle.dump(items, f, protocol=pickle.HIGHEST_PROTOCOL)
@@ -1,8 +1,21 @@
 import numpy as np
 import pickle
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+
+try:
+    from .model_singleton import get_model
+except ImportError:  # run as a script
+    from model_singleton import get_model
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores, best first, in O(N + k log k).
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
 
 # Paths to saved data
 DATA_DIR = Path(__file__).resolve().parents[2] / "data"
@@ -10,25 +23,29 @@ EMBEDDINGS_FILE = DATA_DIR / "embeddings.npy"
 CHUNKS_FILE = DATA_DIR / "chunks.pkl"
 
 # Load saved embeddings and chunks
-embeddings = np.load(EMBEDDINGS_FILE)
+embeddings = np.load(EMBEDDINGS_FILE).astype("float32")
 with open(CHUNKS_FILE, "rb") as f:
     chunks = pickle.load(f)
 
 print(f"Loaded {len(chunks)} chunks with embeddings shape {embeddings.shape}")
 
+# Normalize once so a dot product equals cosine similarity
+embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
 # Load the same embedding model
-model = SentenceTransformer("all-MiniLM-L6-v2")
+model = get_model()
 
 # Your query
 query = "skills"
-query_embedding = model.encode([query])
+query_embedding = model.encode([query]).astype("float32").reshape(-1)
+query_embedding /= np.linalg.norm(query_embedding)
 
-# Compute cosine similarity between query and all chunks
-similarities = cosine_similarity(query_embedding, embeddings)[0]
+# Cosine similarity against every chunk is a single matrix-vector product
+similarities = embeddings @ query_embedding
 
 # Get top N results
 top_n = 3
-top_indices = similarities.argsort()[-top_n:][::-1]
+top_indices = top_k_indices(similarities, top_n)
 
 print(f"\nTop {top_n} chunks for query: '{query}'\n")
 for idx in top_indices:
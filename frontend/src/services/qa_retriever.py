@@ -1,11 +1,15 @@
+import sys
 import faiss
-import pickle
 from pathlib import Path
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from sentence_transformers import SentenceTransformer
 from datetime import datetime
 
+# Share the backend's cached embedding model and query cache
+sys.path.append(str(Path(__file__).resolve().parents[3] / "backend" / "app" / "services"))
+from embedding import embed_query
+from pickle_frames import load_frames
+
 # ----------------------------
 # Paths and Constants
 # ----------------------------
@@ -18,22 +22,18 @@ TOP_K = 3
 # ----------------------------
 # Load chunks and metadata
 # ----------------------------
-with open(CHUNKS_FILE, "rb") as f:
-    chunks = pickle.load(f)
-
-with open(METADATA_FILE, "rb") as f:
-    metadata = pickle.load(f)
+chunks = load_frames(CHUNKS_FILE)
+metadata = load_frames(METADATA_FILE)
 
 # ----------------------------
 # Load FAISS index
 # ----------------------------
-index = faiss.read_index(str(FAISS_INDEX_FILE))
+# IVF indexes are memory-mapped (read-only); flat indexes ignore the flag
+index = faiss.read_index(str(FAISS_INDEX_FILE), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
 print(f"FAISS index loaded with {index.ntotal} vectors")
 
-# ----------------------------
-# Load embedding model
-# ----------------------------
-model = SentenceTransformer("all-MiniLM-L6-v2")
+# The index is keyed by each chunk's faissId, not its position
+id_to_pos = {m["faissId"]: i for i, m in enumerate(metadata)}
 
 # ----------------------------
 # FastAPI app
@@ -53,13 +53,16 @@ class QueryRequest(BaseModel):
 def research(request: QueryRequest):
     try:
         user_query = request.query
-        query_vec = model.encode([user_query]).astype("float32")
+        query_vec = embed_query(user_query)
         distances, indices = index.search(query_vec, TOP_K)
 
         steps = []
         documents = []
 
-        for i, idx in enumerate(indices[0]):
+        for i, faiss_id in enumerate(indices[0]):
+            if faiss_id < 0:
+                continue
+            idx = id_to_pos[int(faiss_id)]
             chunk_text = chunks[idx]
             source = metadata[idx].get("source", "unknown")
 